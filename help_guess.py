@@ -1,13 +1,15 @@
 """ Generate and rank guesses to help solve a Wordle puzzle. """
 
-import sys, argparse, requests, re
+import sys, os, time, argparse, requests, multiprocessing, heapq
 from collections import defaultdict
-from copy import copy, deepcopy
-from itertools import product
+from functools import lru_cache
 from string import ascii_lowercase
 
 # Max guesses shown
 MAX_GUESSES_SHOWN = 100
+# Where downloaded word lists are cached, and for how long (in seconds)
+CACHE_DIR = os.path.expanduser("~/.cache/wordle-guesser")
+CACHE_MAX_AGE = 7 * 86400
 NUM_TO_ORDSTR = {1:'first',
                  2:'second',
                  3:'third',
@@ -15,16 +17,191 @@ NUM_TO_ORDSTR = {1:'first',
                  5:'fifth',
                  6:'sixth'}
 
+def cached_get(url, path, session, max_age=CACHE_MAX_AGE):
+    """Get content at url, using the copy cached at path if it is
+    recent enough, or if the download fails. session is a
+    requests.Session, so that downloads can reuse the same connection.
+
+    """
+    cached = os.path.exists(path)
+    if cached and time.time() - os.path.getmtime(path) < max_age:
+        with open(path, 'rb') as f:
+            return f.read()
+    try:
+        r = session.get(url, allow_redirects=True)
+        r.raise_for_status()
+    except requests.RequestException as e:
+        # Fall back on the stale copy, if any
+        if not cached:
+            raise
+        print(f"WARNING: could not get {url} ({e}), using cached copy")
+        with open(path, 'rb') as f:
+            return f.read()
+    # Write to a temporary file first, so an interrupted write does not
+    # leave a truncated copy in the cache
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(r.content)
+    os.replace(tmp_path, path)
+    return r.content
+
+def index_words(words):
+    """Map each position and letter code to the set of words that have
+    that letter at that position. Sets of words are stored as bitsets,
+    i.e. ints whose bit i is set iff words[i] is in the set.
+
+    """
+    pos_letter_bits = [[0 for _ in range(26)] for _ in range(5)]
+    if not len(words):
+        return pos_letter_bits
+    # Tables that translate a letter to '1' and the others to '0'
+    tables = [{ord(c):'1' if c == letter else '0' for c in ascii_lowercase}
+              for letter in ascii_lowercase]
+    for pos in range(5):
+        # Letters at this position, last word first, so that a
+        # letter's bitset can be parsed from the translated column
+        column = ''.join(word[pos] for word in reversed(words))
+        for code in range(26):
+            pos_letter_bits[pos][code] = int(column.translate(tables[code]), 2)
+    return pos_letter_bits
+
+def index_letter_counts(pos_letter_bits, nb_words):
+    """Map each letter code and count m (0-5) to the bitset of words
+    that contain that letter at least m times.
+
+    """
+    letter_count_bits = []
+    for code in range(26):
+        at_least = [(1 << nb_words) - 1] + [0 for _ in range(5)]
+        for pos in range(5):
+            bits = pos_letter_bits[pos][code]
+            for m in range(5, 0, -1):
+                at_least[m] |= at_least[m-1] & bits
+        letter_count_bits.append(at_least)
+    return letter_count_bits
+
+def bits_to_indices(bits):
+    """Get list of indices (into word_list) of the words in bitset."""
+    digits = bin(bits)[:1:-1]
+    found = []
+    i = digits.find('1')
+    while i != -1:
+        found.append(i)
+        i = digits.find('1', i + 1)
+    return found
+
+def bits_to_words(bits):
+    """Get list of words in bitset."""
+    return [word_list[i] for i in bits_to_indices(bits)]
+
+def init_scorer(word_index, guess_bits):
+    """Set the data shared by calls to score_guess, e.g. in a worker
+    process. word_index is (pos_letter_bits, letter_count_bits).
+
+    """
+    global pos_letter_bits, letter_count_bits, scorer_guess_bits
+    pos_letter_bits, letter_count_bits = word_index
+    scorer_guess_bits = guess_bits
+    return
+
+def group_positions(guess):
+    """Map codes of the letters in guess to their positions."""
+    letter_to_pos = defaultdict(list)
+    for pos, letter in enumerate(guess):
+        letter_to_pos[ord(letter) - 97].append(pos)
+    return {code:tuple(positions) for code, positions in letter_to_pos.items()}
+
+@lru_cache(maxsize=None)
+def letter_feedback_bits(code, positions):
+    """Split the word list by the colours that the letter with this
+    code, guessed at these positions, would get if each word were the
+    answer. Return a dict that maps colours (a string of labels, one
+    per position) to a bitset of words.
+
+    """
+    parts = {}
+    at_least = letter_count_bits[code]
+    for green_mask in range(1 << len(positions)):
+        # Words with the letter at exactly these guessed positions
+        bits = at_least[0]
+        for i, pos in enumerate(positions):
+            if (green_mask >> i) & 1:
+                bits &= pos_letter_bits[pos][code]
+            else:
+                bits &= ~pos_letter_bits[pos][code]
+        # The remaining occurrences of the letter make the other
+        # guessed positions yellow, from left to right
+        nb_green = green_mask.bit_count()
+        nb_other = len(positions) - nb_green
+        for nb_yellow in range(nb_other + 1):
+            part = bits & at_least[nb_green + nb_yellow]
+            if nb_yellow < nb_other:
+                part &= ~at_least[nb_green + nb_yellow + 1]
+            if part:
+                colours = []
+                nb_left = nb_yellow
+                for i in range(len(positions)):
+                    if (green_mask >> i) & 1:
+                        colours.append('2')
+                    elif nb_left:
+                        colours.append('1')
+                        nb_left -= 1
+                    else:
+                        colours.append('0')
+                parts[''.join(colours)] = part
+    return parts
+
+def feedback_to_bits(guess, labels):
+    """Get bitset of words that would give these labels to guess if
+    they were the answer.
+
+    """
+    bits = -1
+    for code, positions in group_positions(guess).items():
+        colours = ''.join(labels[pos] for pos in positions)
+        bits &= letter_feedback_bits(code, positions).get(colours, 0)
+    return bits
+
+def score_guess(guess):
+    """Compute expected reduction of search space if guess is played,
+    i.e. 1 minus the expected fraction of current guesses left once
+    its colours are known, assuming each current guess is equally
+    likely to be the answer. Return (guess, score).
+
+    """
+    # Partition current guesses by the colours guess would get
+    classes = [scorer_guess_bits]
+    for code, positions in group_positions(guess).items():
+        parts = letter_feedback_bits(code, positions).values()
+        classes = [bits for c in classes for part in parts if (bits := c & part)]
+    nb_guesses = scorer_guess_bits.bit_count()
+    sum_sq = sum(c.bit_count() ** 2 for c in classes)
+    return guess, 1 - sum_sq / nb_guesses ** 2
+
+def collect_scores(scored, nb_guesses):
+    """Map guesses to scores from (guess, score) pairs, reporting
+    progress.
+
+    """
+    scores = {}
+    for guess, score in scored:
+        scores[guess] = score
+        if len(scores) % 100 == 0:
+            print(f"Nb guesses scored: {len(scores)}/{nb_guesses}")
+    return scores
+
 class GameState:
     def __init__(self):
         self.turn = 1 # Turn
-        self.elim = set() # eliminated letters
-        self.green = [None for _ in range(5)] # green letters in position
-        self.yellow = {} # Maps yellow letters to positions that were tried
+        self.candidates = None # bitset of words consistent with labels so far
         return
 
     def copy(self):
-        return deepcopy(self)
+        clone = GameState()
+        clone.turn = self.turn
+        clone.candidates = self.candidates
+        return clone
 
     def increment_turn(self):
         if self.turn == 6:
@@ -33,180 +210,86 @@ class GameState:
         self.turn += 1
         return
 
-    def letter_in_yellow(self, letter):
-        return letter in self.yellow
-
-    def yellow_letters(self):
-        return set(self.yellow.keys())
-
-    def remove_letter_from_yellow(letter):
-        del self.yellow[letter]
-        return
-
     def update(self, guess, labels, increment_turn=True):
         if increment_turn:
             self.increment_turn()
-        green_here = defaultdict(list)
-        yellow_here = defaultdict(list)
-        grey_here = defaultdict(list)
-        for position, (letter, label) in enumerate(zip(guess, labels)):
-            if label == '0':
-                grey_here[letter].append(position)
-            elif label == '1':
-                yellow_here[letter].append(position)
-            elif label == '2':
-                green_here[letter].append(position)
-        for letter, positions in grey_here.items():
-            self.elim.add(letter)
-        for letter, positions in yellow_here.items():
-            if letter not in self.yellow:
-                self.yellow[letter] = set()
-            for position in positions:
-                self.yellow[letter].add(position)        
-        for letter, positions in green_here.items():
-            for position in positions:
-                if self.green[position] is not None:
-                    if letter != self.green[position]:
-                        msg = "Expected green letters not to change"
-                        raise RuntimeError(msg)
-                else:
-                    self.green[position] = letter
-                    if letter in self.yellow:
-                        if letter in yellow_here:
-                            if position in self.yellow[letter]:
-                                self.yellow[letter].remove(position)
-                        else:
-                            del self.yellow[letter]
+        bits = feedback_to_bits(guess, labels)
+        self.candidates = bits if self.candidates is None else self.candidates & bits
         return
-    
-    def get_tried_yellows_for_position(self, position):
-        assert position in range(5)
-        yellows = set()
-        for letter, tried in self.yellow.items():
-            if position in tried:
-                yellows.add(letter)
-        return yellows
 
     def generate_guesses(self):
         """Identify all possible guesses based on game state."""
-    
-        # List green positions
-        green_pos = [i for i in range(5) if self.green[i] is not None]
-    
-        # Map yellow letters to positions that are open for them
-        ylet_to_open = {}
-        for letter, tried in game_state.yellow.items():
-            ylet_to_open[letter] = set(range(5)).difference(tried).difference(green_pos) 
-            if not len(ylet_to_open[letter]):
-                msg = f"No open positions left for letter '{ylet}'"
-                raise RuntimeError(msg)
-    
-        # Check if we have found any new green position,
-        # i.e. positions that are the last valid position for a yellow
-        # letter
-        green_found = [None for _ in range(5)]
-        for ylet in list(ylet_to_open.keys()):
-            openset = ylet_to_open[ylet]
-            if len(openset) == 1:
-                only_pos = list(openset)[0]
-                if self.green[only_pos] is not None:
-                    msg = f"No open positions left for letter '{ylet}'"
-                    raise RuntimeError(msg)
-                green_found[only_pos] = ylet
-                del ylet_to_open[ylet]
-    
-        # Generate all templates using yellow letters that have more
-        # than one open position left
-        green_template = ['_' if x is None else x for x in self.green]
-        for pos, letter in enumerate(green_found):
-            if letter is not None:
-                green_template[pos] = letter
-        if not len(ylet_to_open):
-            templates = [green_template]
-        else:
-            templates = []        
-            sorted_ylets = sorted(ylet_to_open.keys())
-            openlists = [sorted(ylet_to_open[k]) for k in sorted_ylets]
-            crossprod = [list(x) for x in list(product(*openlists))]
-            poslists = [x for x in crossprod if len(x) == len(set(x))]
-            for poslist in poslists:
-                template = copy(green_template)
-                for ylet, pos in zip(sorted_ylets, poslist):
-                    template[pos] = ylet
-                templates.append(template)
-    
-        # Make regex patterns
-        nonelim = set(ascii_lowercase).difference(self.elim)
-        patterns = []
-        for i in range(len(templates)):
-            for pos in range(5):
-                if templates[i][pos] == '_':
-                    tried = self.get_tried_yellows_for_position(pos)                
-                    chars = nonelim.difference(tried)
-                    char_class = f"[{''.join(sorted(chars))}]"
-                    templates[i][pos] = char_class
-        for template in templates:
-            pattern = re.compile(''.join(template))
-            patterns.append(pattern)
-      
-        # Generate guesses
-        guesses = []
-        for word in words:
-            for p in patterns:
-                if p.match(word):
-                    guesses.append(word)
-                    break
-        return guesses, green_found
-
-    def generate_ranked_guesses(self, wordfreq, Lambda):
+        return bits_to_words(self.generate_guess_bits())
+
+    def generate_guess_bits(self):
+        """Identify all possible guesses based on game state, i.e. the
+        words that would have given the labels entered so far, and
+        return them as a bitset over the word list.
+
+        """
+        if self.candidates is None:
+            return (1 << len(word_list)) - 1
+        return self.candidates
+
+    def generate_ranked_guesses(self, wordfreq, Lambda, nb_procs=1):
         """Identify all possible guesses based on game state, rank, and
-        return.
+        return the top MAX_GUESSES_SHOWN as (index, score) tuples,
+        along with a dict that maps all guesses to their reduction of
+        search space. wordfreq is a sequence of frequencies aligned
+        with word_list.
 
         """
-        guesses, green_found = self.generate_guesses()
+        guess_bits = self.generate_guess_bits()
+        indices = bits_to_indices(guess_bits)
+        guesses = [word_list[i] for i in indices]
+
+        # If Lambda is 0, the score is just the frequency, so we don't
+        # need the reduction of search space
+        if Lambda == 0:
+            top = heapq.nlargest(MAX_GUESSES_SHOWN, indices, key=wordfreq.__getitem__)
+            return [(i, wordfreq[i]) for i in top], {g:0.0 for g in guesses}
         
-        # Assume each guess is wrong, and generate next guesses
-        # for each. Compute reduction of search space.
-        labels = ['0' for _ in range(5)]
-        for pos in range(5):
-            if self.green[pos] is not None or green_found[pos] is not None:
-                labels[pos] == '2'
-        space_redux = {}
-        for gix, g in enumerate(guesses):
-            next_state = self.copy()
-            next_state.update(g, labels)
-            next_guesses, _ = next_state.generate_guesses()
-            # Initial score is reduction of search space assuming guess is wrong 
-            space_redux[g] = (len(guesses) - len(next_guesses)) / len(guesses)
-            if (gix+1) % 100 == 0:
-                print(f"Nb guesses scored: {gix+1}/{len(guesses)}")
-        scored_guesses = []
-        for g in guesses:
-            score = Lambda * space_redux[g] + ((1 - Lambda) * wordfreq[g])
-            scored_guesses.append((g, score))
-        print(f"Nb guesses scored: {gix+1}/{len(guesses)}")
-        ranked_guesses = sorted(scored_guesses, key=lambda x:x[1], reverse=True)
+        # Compute expected reduction of search space for each guess
+        scorer_args = ((pos_letter_bits, letter_count_bits), guess_bits)
+        # Only use a pool if there is enough work to share
+        if nb_procs > 1 and len(guesses) > 32 * nb_procs:
+            with multiprocessing.Pool(nb_procs, initializer=init_scorer, initargs=scorer_args) as pool:
+                scored = pool.imap_unordered(score_guess, guesses, chunksize=32)
+                space_redux = collect_scores(scored, len(guesses))
+        else:
+            init_scorer(*scorer_args)
+            space_redux = collect_scores(map(score_guess, guesses), len(guesses))
+        if Lambda == 1:
+            scored_guesses = [(i, space_redux[g]) for i, g in zip(indices, guesses)]
+        else:
+            scored_guesses = []
+            for i, g in zip(indices, guesses):
+                score = Lambda * space_redux[g] + ((1 - Lambda) * wordfreq[i])
+                scored_guesses.append((i, score))
+        print(f"Nb guesses scored: {len(space_redux)}/{len(guesses)}")
+        ranked_guesses = heapq.nlargest(MAX_GUESSES_SHOWN, scored_guesses, key=lambda x:x[1])
         return ranked_guesses, space_redux
 
 def present_guesses(ranked_guesses, wordfreq, space_redux):
+    """Print top guesses. ranked_guesses is a list of (index, score)
+    tuples, wordfreq is aligned with word_list, and space_redux has an
+    entry for every guess.
+
+    """
     nb_shown = min(MAX_GUESSES_SHOWN, len(ranked_guesses))
-    for i in range(nb_shown):
-        guess_num = i + 1
-        x = ranked_guesses[i]
-        if len(x) == 2:
-            guess, score = x
-            print(f"{guess_num}\t{guess}\t{score:.4f} (space-redux={space_redux[guess]:.4f}, freq={wordfreq[guess]:.4f})")
-        else:
-            msg = f"Expected (guess, score), but found this: '{x}'"
-            raise RuntimeError(msg)
-    if len(ranked_guesses) > nb_shown:
-        print(f"... plus {len(ranked_guesses)-nb_shown} lower-ranked guesses")
+    lines = []
+    for rank, (i, score) in enumerate(ranked_guesses[:nb_shown]):
+        guess = word_list[i]
+        lines.append(f"{rank+1}\t{guess}\t{score:.4f} (space-redux={space_redux[guess]:.4f}, freq={wordfreq[i]:.4f})\n")
+    sys.stdout.write(''.join(lines))
+    if len(space_redux) > nb_shown:
+        print(f"... plus {len(space_redux)-nb_shown} lower-ranked guesses")
     return
 
 
-def interact(game_state, wordfreq, Lambda):
+def interact(game_state, wordfreq, Lambda, nb_procs):
     # Generate all possible guesses
-    ranked_guesses, space_redux = game_state.generate_ranked_guesses(wordfreq, Lambda)
+    ranked_guesses, space_redux = game_state.generate_ranked_guesses(wordfreq, Lambda, nb_procs)
     if not len(ranked_guesses):
         msg = "Error: no guesses found"
         raise RuntimeError(msg)
@@ -217,7 +300,7 @@ def interact(game_state, wordfreq, Lambda):
     # Ask for guess
     turn_ordstr = NUM_TO_ORDSTR[game_state.turn]
     ans = input(f"\nEnter letters of your {turn_ordstr} guess: ").strip().lower()
-    assert ans.isalpha() and len(ans) == 5, "Expected 5 letters"
+    assert ans.isascii() and ans.isalpha() and len(ans) == 5, "Expected 5 letters between a-z"
     guess = list(ans)
     ans = input(f"Enter colours returned for your {turn_ordstr} guess ('{ans}'): ").strip()
     assert len(ans) == 5, "Expected 5 digits between 0-2"
@@ -238,46 +321,64 @@ if __name__ == "__main__":
                    type=float,
                    default=0.5,
                    help="coefficient of scoring function (> 0.5 will weight space-redux more heavily)")
+    p.add_argument("--nb_procs",
+                   type=int,
+                   default=os.cpu_count() or 1,
+                   help="number of processes used to score guesses")
     args = p.parse_args()
     assert args.Lambda >= 0 and args.Lambda <= 1, "lambda must be between 0 and 1"
+    assert args.nb_procs >= 1, "nb_procs must be at least 1"
     
     # Get word list
     print("\nGetting word list")
-    r = requests.get("https://raw.githubusercontent.com/tabatkins/wordle-list/main/words",
-                     allow_redirects=True)
-    words = set(r.text.split("\n"))
-    print(f"Nb words: {len(words)}")        
+    session = requests.Session()
+    content = cached_get("https://raw.githubusercontent.com/tabatkins/wordle-list/main/words",
+                         os.path.join(CACHE_DIR, "words"),
+                         session)
+    # Keep five-letter lowercase words only, which also drops the empty
+    # string after the trailing newline. The sorted tuple fixes the
+    # order of words in bitsets and in output.
+    words = frozenset(word for word in content.decode().split()
+                      if len(word) == 5 and word.isascii() and word.isalpha() and word.islower())
+    word_list = tuple(sorted(words))
+    print(f"Nb words: {len(word_list)}")        
+    pos_letter_bits = index_words(word_list)
+    letter_count_bits = index_letter_counts(pos_letter_bits, len(word_list))
     
     # Get word frequency list
     print("\nGetting word frequency list")
-    r = requests.get("http://corpus.leeds.ac.uk/frqc/internet-en.num",
-                     allow_redirects=True)
-    lines = r.text.split("\n")
+    content = cached_get("http://corpus.leeds.ac.uk/frqc/internet-en.num",
+                         os.path.join(CACHE_DIR, "internet-en.num"),
+                         session)
+    session.close()
+    # Only ASCII words are looked up, so stray bytes elsewhere in the
+    # list can be replaced rather than stop the decoding
+    lines = content.decode(errors="replace").splitlines()
     # skip header
     lines = lines[4:]
-    word2freq = {word:0 for word in words}
+    word2freq = {} # Words missing from the frequency list get 0 when aligned
     words_found = 0
     for line in lines:
-        line = line.strip()
-        if len(line):
-            elems = line.split()
-            if not len(elems) == 3: 
+        # Rows are rank, frequency and word. Only split off the word,
+        # and parse the rest if the word is in the word list.
+        fields = line.rsplit(None, 1)
+        if fields and fields[-1] in words:
+            word = fields[-1]
+            rest = fields[0].split() if len(fields) == 2 else []
+            if not len(rest) == 2:
                 print(f"WARNING: skipping line in freq list: Expected 3 space-separated strings in each row, got '{line}'")
                 continue
-            rank, freq, word = elems
-            rank = int(rank)
-            freq = float(freq)
-            if word in words:
-                word2freq[word] = freq
-                words_found += 1
+            word2freq[word] = float(rest[1])
+            words_found += 1
     print(f"{words_found}/{len(words)} words found in frequency list")
 
-    # Normalize
-    max_freq = max(word2freq.values())
-    norm_word2freq = {w:f/max_freq for (w,f) in word2freq.items()} 
+    # Normalize, and align with the word list so guesses can look up
+    # their frequency by index
+    max_freq = max(word2freq.values(), default=1.0)
+    word_freq = tuple(word2freq.get(w, 0.0) / max_freq for w in word_list)
         
     # Interact with user
     game_state = GameState()
     for turn in range(6):
-        game_state = interact(game_state, norm_word2freq, args.Lambda)
+        game_state = interact(game_state, word_freq, args.Lambda, args.nb_procs)
 